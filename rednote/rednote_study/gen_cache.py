@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+小红书文案生成式缓存 (GenCache)
+
+不同产品、相同风格的请求共享同一个提示词骨架（"请为产品「X」生成……语气Y……"），
+语义缓存在这种情况下可能把 X 的文案原样返回给 Y。生成式缓存把请求拆成
+稳定的骨架和槽位变量 (product, tone)，缓存时把文案中出现的产品名替换为 {product}
+占位符，命中时再用新的槽位值填充模板，整个过程只做本地字符串替换，不调用 LLM。
+
+注意：模板只替换产品名，成分、功效、规格等描述仍来自原产品，填充结果只适合作为草稿，
+因此 rednote.py 中默认不启用生成式缓存（use_gen_cache=False）。
+"""
+
+import os
+import re
+import shelve
+import hashlib
+
+# 从用户消息中提取槽位：产品名位于「」内，风格紧跟在"语气"之后
+_SLOT_RE = re.compile(r"请为产品「(?P<product>.+?)」.*?语气(?P<tone>[^，,。]+)")
+
+# 参与模板化的文案字段
+_TEMPLATE_FIELDS = ("title", "body", "hashtags")
+
+# 填充后文本长度相对原文案的变化超过该比例时，需要对相关句子做一次改写
+LENGTH_DRIFT_LIMIT = 0.2
+
+
+def extract_slots(user_message: str):
+    """
+    将用户消息拆分为骨架和槽位。
+
+    Returns:
+        tuple | None: (skeleton_id, {"product": ..., "tone": ...})，无法识别时返回 None。
+    """
+    match = _SLOT_RE.search(user_message)
+    if not match:
+        return None
+    skeleton = (
+        user_message[:match.start("product")] + "{product}"
+        + user_message[match.end("product"):match.start("tone")] + "{tone}"
+        + user_message[match.end("tone"):]
+    )
+    skeleton_id = hashlib.sha1(skeleton.encode("utf-8")).hexdigest()
+    return skeleton_id, {"product": match.group("product"), "tone": match.group("tone")}
+
+
+def _to_template(text: str, product_name: str) -> str:
+    """将文本中的产品名替换为 {product} 占位符，并转义原有的花括号。"""
+    escaped = text.replace("{", "{{").replace("}", "}}")
+    return escaped.replace(product_name, "{product}")
+
+
+def _note_length(note: dict) -> int:
+    """计算参与模板化的字段总长度。"""
+    total = 0
+    for field in _TEMPLATE_FIELDS:
+        value = note.get(field, "")
+        total += sum(len(v) for v in value) if isinstance(value, list) else len(value)
+    return total
+
+
+class GenerativeCache:
+    """按 (骨架, 风格) 存储文案模板的生成式缓存。"""
+
+    def __init__(self, cache_dir: str, scope: str = ""):
+        """scope 标识命名空间、模型和 System Prompt，不同 scope 的模板保存在不同的文件中。"""
+        os.makedirs(cache_dir, exist_ok=True)
+        self._path = os.path.join(cache_dir, f"gen_cache_{scope}" if scope else "gen_cache")
+
+    @staticmethod
+    def _entry_key(skeleton_id: str, slots: dict) -> str:
+        # 除产品外的其余槽位必须完全相等才能复用模板
+        return f"{skeleton_id}|{slots['tone']}"
+
+    def add(self, user_message: str, note: dict) -> bool:
+        """
+        将文案模板化后存入缓存。
+
+        文案中没有出现产品名时无法模板化，不会写入缓存。
+
+        Returns:
+            bool: 是否成功写入。
+        """
+        parsed = extract_slots(user_message)
+        if parsed is None:
+            return False
+        skeleton_id, slots = parsed
+        product_name = slots["product"]
+
+        template = {}
+        mentions = 0
+        for field in _TEMPLATE_FIELDS:
+            value = note.get(field, "")
+            if isinstance(value, list):
+                mentions += sum(v.count(product_name) for v in value)
+                template[field] = [_to_template(v, product_name) for v in value]
+            else:
+                mentions += value.count(product_name)
+                template[field] = _to_template(value, product_name)
+        if mentions == 0:
+            return False
+
+        entry = {
+            "slot_schema": ("product", "tone"),
+            "source_product": product_name,
+            "source_length": _note_length(note),
+            "template": template,
+            "extra": {k: v for k, v in note.items() if k not in _TEMPLATE_FIELDS},
+        }
+        with shelve.open(self._path) as cache:
+            cache[self._entry_key(skeleton_id, slots)] = entry
+        return True
+
+    def lookup(self, user_message: str):
+        """
+        用新的槽位值填充已缓存的模板。
+
+        Returns:
+            tuple | None: 命中时返回 (文案 dict, 长度变化比例)，否则返回 None。
+        """
+        parsed = extract_slots(user_message)
+        if parsed is None:
+            return None
+        skeleton_id, slots = parsed
+        with shelve.open(self._path) as cache:
+            entry = cache.get(self._entry_key(skeleton_id, slots))
+        if entry is None or entry["source_product"] == slots["product"]:
+            # 同一产品应由精确缓存处理，这里只负责"换产品"的情况
+            return None
+
+        note = {}
+        for field, value in entry["template"].items():
+            if isinstance(value, list):
+                note[field] = [v.format_map(slots) for v in value]
+            else:
+                note[field] = value.format_map(slots)
+        note.update(entry["extra"])
+
+        drift = abs(_note_length(note) - entry["source_length"]) / max(entry["source_length"], 1)
+        return note, drift
@@ -15,37 +15,123 @@ DeepSeek Agent 实战：小红书爆款文案生成助手
 """
 
 import os
-import json
 import re
-import random
+import io
+import csv
+import json
 import time
-from openai import OpenAI
+import shelve
+import hashlib
+import argparse
+import asyncio
+import inspect
+import threading
+import functools
+from typing import Final, List
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import msgspec
+import orjson
+
+from gen_cache import GenerativeCache, LENGTH_DRIFT_LIMIT
+from semantic_cache import SemanticCache, semantic_cache_available
+
+
+# JSON 解析与序列化统一使用 orjson（Rust 实现，比标准库 json 快数倍）。
+# orjson 原生输出 UTF-8，不存在 ensure_ascii 的问题；orjson.JSONDecodeError 是 json.JSONDecodeError 的子类。
+JSONDecodeError = orjson.JSONDecodeError
+_loads = orjson.loads
+
+
+def _dumps(obj) -> str:
+    """将对象序列化为缩进 2 格的 JSON 字符串。"""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode("utf-8")
 
 
 # =============================================================================
 # 1. 环境准备与DeepSeek API配置
 # =============================================================================
 
+# openai / httpx 导入较慢（会连带加载 pydantic 等依赖），只在真正创建客户端时才导入，
+# 这样只使用格式化功能（如 format_rednote_for_markdown）时可以快速启动。
+
+def _http_client_options() -> dict:
+    """
+    httpx 连接池配置。
+
+    ReAct 循环每篇文案最多调用 API 5 次，复用同一个启用 HTTP/2 和长连接的 httpx 连接池，
+    避免每次请求重新进行 TCP / TLS 握手。
+    """
+    import httpx
+
+    return {
+        "http2": True,
+        "timeout": httpx.Timeout(60.0, connect=5.0),
+        "limits": httpx.Limits(max_keepalive_connections=32, keepalive_expiry=60),
+    }
+
+# 模块级单例，多次调用 setup_deepseek_client 得到的是同一个客户端
+_client = None
+
+
 def setup_deepseek_client():
     """
-    初始化 DeepSeek 客户端
+    初始化 DeepSeek 客户端（进程内单例，复用 HTTP 连接池）
     
     Returns:
         OpenAI: DeepSeek 客户端实例
     """
+    global _client
+    if _client is None:
+        import httpx
+        from openai import OpenAI
+
+        # 初始化 DeepSeek 客户端
+        _client = OpenAI(
+            api_key=_get_api_key(),
+            base_url=DEEPSEEK_BASE_URL,  # DeepSeek API 的基地址
+            http_client=httpx.Client(**_http_client_options()),
+        )
+    
+    return _client
+
+
+def setup_async_deepseek_client():
+    """
+    初始化异步 DeepSeek 客户端，用于并发生成多篇文案
+
+    异步连接池绑定在创建它的事件循环上，因此这里不做全局单例：
+    请在同一次 asyncio.run 中复用返回的客户端，并在事件循环结束前关闭它
+    （async with client: 或 await client.close()），否则连接池中的 HTTP/2 连接不会被释放。
+
+    Returns:
+        AsyncOpenAI: 异步 DeepSeek 客户端实例
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(
+        api_key=_get_api_key(),
+        base_url=DEEPSEEK_BASE_URL,
+        http_client=httpx.AsyncClient(**_http_client_options()),
+    )
+
+
+def _get_api_key() -> str:
+    """从环境变量读取 DeepSeek API Key。"""
     # 建议将 API Key 设置为环境变量，避免直接暴露在代码中
-    # 从环境变量获取 DeepSeek API Key
     api_key = os.getenv("DEEPSEEK_API_KEY")
     if not api_key:
         raise ValueError("请设置 DEEPSEEK_API_KEY 环境变量")
+    return api_key
 
-    # 初始化 DeepSeek 客户端
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://api.deepseek.com/v1",  # DeepSeek API 的基地址
-    )
-    
-    return client
+
+# DeepSeek API 的基地址
+DEEPSEEK_BASE_URL = "https://api.deepseek.com/v1"
+
+# 使用的模型名称，同时参与缓存键的计算
+DEEPSEEK_MODEL = "deepseek-chat"
 
 
 # =============================================================================
@@ -82,29 +168,36 @@ Agent 任务规划：核心工作流
 # 3.1 System Prompt (系统提示词)
 # System Prompt 是 Agent 的"大脑"和"行为准则"。它定义了 Agent 的角色、目标以及工作方式。
 # 我们将采用 Thought-Action-Observation (ReAct) 模式来引导 DeepSeek 的推理过程。
+#
+# DeepSeek 会对请求中逐字节相同的前缀（系统提示词 + 工具定义）复用服务端 KV 缓存，
+# ReAct 循环的后续轮次只需为新追加的消息付出 prefill 成本。因此：
+# - SYSTEM_PROMPT 在导入时统一换行符并去掉首尾空白，此后不再修改；
+# - 不要把时间戳、随机数等每次请求都不同的内容拼进系统消息，这类信息只能放在 user / tool 消息中。
 
-SYSTEM_PROMPT = """
+SYSTEM_PROMPT: Final[str] = """
 你是一个资深的小红书爆款文案专家，擅长结合最新潮流和产品卖点，创作引人入胜、高互动、高转化的笔记文案。
 
 你的任务是根据用户提供的产品和需求，生成包含标题、正文、相关标签和表情符号的完整小红书笔记。
 
-请始终采用'Thought-Action-Observation'模式进行推理和行动。文案风格需活泼、真诚、富有感染力。当完成任务后，请以JSON格式直接输出最终文案，格式如下：
-```json
+请始终采用'Thought-Action-Observation'模式进行推理和行动。文案风格需活泼、真诚、富有感染力。当完成任务后，请直接输出一个JSON对象作为最终文案，包含 title、body、hashtags、emojis 四个键，不要附加任何其他文字，格式如下：
 {
   "title": "小红书标题",
   "body": "小红书正文",
   "hashtags": ["#标签1", "#标签2", "#标签3", "#标签4", "#标签5"],
   "emojis": ["✨", "🔥", "💖"]
 }
-```
 在生成文案前，请务必先思考并收集足够的信息。
-"""
+""".replace("\r\n", "\n").strip()
+
+# 用户请求模板。产品名和风格是仅有的两个槽位，生成式缓存依赖这一固定骨架来识别相似请求。
+USER_PROMPT_TEMPLATE = "请为产品「{product_name}」生成一篇小红书爆款文案。要求：语气{tone_style}，包含标题、正文、至少5个相关标签和5个表情符号。请以单个JSON对象输出。"
 
 # 3.2 Tools (工具定义)
 # Agent 的"双手"由一系列可调用的工具组成。这些工具扩展了 LLM 的能力，
 # 使其能够获取实时信息、查询数据库或执行特定操作。
+# 工具定义同样属于可缓存的前缀，使用 tuple 保存，顺序固定且不应在运行时修改。
 
-TOOLS_DEFINITION = [
+TOOLS_DEFINITION: Final[tuple] = (
     {
         "type": "function",
         "function": {
@@ -156,7 +249,21 @@ TOOLS_DEFINITION = [
             }
         }
     }
-]
+)
+
+
+# 最终文案的结构定义。msgspec 在 C 层完成解码和校验，比 json + 手工检查更快，
+# 且能在模型输出缺字段、类型不对时给出具体的错误信息，反馈给模型进行修正。
+
+class RednoteFinal(msgspec.Struct, frozen=True):
+    """最终文案：标题、正文、标签和表情符号，四个字段都是必填的。"""
+    title: str
+    body: str
+    hashtags: List[str]
+    emojis: List[str]
+
+
+_NOTE_DECODER = msgspec.json.Decoder(RednoteFinal)
 
 
 # =============================================================================
@@ -166,11 +273,26 @@ TOOLS_DEFINITION = [
 # 由于我们无法直接调用真实的外部 API (如Google Search或内部产品数据库)，
 # 我们将创建一些模拟 (Mock) 工具函数来演示 Agent 的工作流程。
 # 在实际应用中，您需要将这些模拟函数替换为真实的 API 调用。
+#
+# ReAct 过程中经常重复查询同一个关键词，模拟工具的结果只取决于输入参数，
+# 因此用 lru_cache 缓存：重复调用直接返回，不再重复付出模拟延迟。
+# 替换为真实 API 后，可以改用带过期时间的缓存（如 cachetools.TTLCache），以 JSON 序列化后的参数为键。
 
+# 设置环境变量 REDNOTE_MOCK_DELAY=0 可关闭模拟延迟（例如在测试中）
+MOCK_DELAY_ENABLED = os.getenv("REDNOTE_MOCK_DELAY", "1") == "1"
+
+
+def _mock_delay(seconds: float) -> None:
+    """模拟外部调用的耗时。"""
+    if MOCK_DELAY_ENABLED:
+        time.sleep(seconds)
+
+
+@lru_cache(maxsize=512)
 def mock_search_web(query: str) -> str:
     """模拟网页搜索工具，返回预设的搜索结果。"""
     print(f"[Tool Call] 模拟搜索网页：{query}")
-    time.sleep(1)  # 模拟网络延迟
+    _mock_delay(1)  # 模拟网络延迟
     if "小红书美妆趋势" in query:
         return "近期小红书美妆流行'多巴胺穿搭'、'早C晚A'护肤理念、'伪素颜'妆容，热门关键词有#氛围感、#抗老、#屏障修复。"
     elif "保湿面膜" in query:
@@ -181,10 +303,11 @@ def mock_search_web(query: str) -> str:
         return f"未找到关于 '{query}' 的特定信息，但市场反馈通常关注产品成分、功效和用户体验。"
 
 
+@lru_cache(maxsize=512)
 def mock_query_product_database(product_name: str) -> str:
     """模拟查询产品数据库，返回预设的产品信息。"""
     print(f"[Tool Call] 模拟查询产品数据库：{product_name}")
-    time.sleep(0.5)  # 模拟数据库查询延迟
+    _mock_delay(0.5)  # 模拟数据库查询延迟
     if "深海蓝藻保湿面膜" in product_name:
         return "深海蓝藻保湿面膜：核心成分为深海蓝藻提取物，富含多糖和氨基酸，能深层补水、修护肌肤屏障、舒缓敏感泛红。质地清爽不粘腻，适合所有肤质，尤其适合干燥、敏感肌。规格：25ml*5片。"
     elif "美白精华" in product_name:
@@ -193,20 +316,37 @@ def mock_query_product_database(product_name: str) -> str:
         return f"产品数据库中未找到关于 '{product_name}' 的详细信息。"
 
 
-def mock_generate_emoji(context: str) -> list:
-    """模拟生成表情符号，根据上下文提供常用表情。"""
+# 关键词 → 表情符号的查表分类。每个分组用一个前瞻断言表示，re.match 在位置 0 按顺序尝试各分组，
+# 第一个命中的分组即为结果，与原先 if/elif 链的优先级一致，但只需一次正则调用。
+_EMOJI_RE = re.compile(
+    r"(?=[\s\S]*(补水|水润|保湿))"
+    r"|(?=[\s\S]*(惊喜|哇塞|爱了))"
+    r"|(?=[\s\S]*(熬夜|疲惫))"
+    r"|(?=[\s\S]*(好物|推荐))"
+)
+_EMOJI_TABLE = (
+    ("💦", "💧", "🌊", "✨"),
+    ("💖", "😍", "🤩", "💯"),
+    ("😭", "😮‍💨", "😴", "💡"),
+    ("✅", "👍", "⭐", "🛍️"),
+)
+# 未命中任何关键词时的兜底表情，按上下文词数截取（最多 5 个）
+_FALLBACK_POOL = ("✨", "🔥", "💖", "💯", "🎉", "👍", "🤩", "💧", "🌿")
+
+
+@lru_cache(maxsize=512)
+def mock_generate_emoji(context: str) -> tuple:
+    """
+    模拟生成表情符号，根据上下文提供常用表情。
+
+    返回不可变的 tuple，避免调用方修改被缓存的结果；结果完全由输入决定，缓存才有意义。
+    """
     print(f"[Tool Call] 模拟生成表情符号，上下文：{context}")
-    time.sleep(0.2)  # 模拟生成延迟
-    if "补水" in context or "水润" in context or "保湿" in context:
-        return ["💦", "💧", "🌊", "✨"]
-    elif "惊喜" in context or "哇塞" in context or "爱了" in context:
-        return ["💖", "😍", "🤩", "💯"]
-    elif "熬夜" in context or "疲惫" in context:
-        return ["😭", "😮‍💨", "😴", "💡"]
-    elif "好物" in context or "推荐" in context:
-        return ["✅", "👍", "⭐", "🛍️"]
-    else:
-        return random.sample(["✨", "🔥", "💖", "💯", "🎉", "👍", "🤩", "💧", "🌿"], k=min(5, len(context.split())))
+    _mock_delay(0.2)  # 模拟生成延迟
+    match = _EMOJI_RE.match(context)
+    if match and match.lastindex:
+        return _EMOJI_TABLE[match.lastindex - 1]
+    return _FALLBACK_POOL[:min(5, len(context.split()))]
 
 
 # 将模拟工具函数映射到一个字典，方便通过名称调用
@@ -216,6 +356,430 @@ available_tools = {
     "generate_emoji": mock_generate_emoji,
 }
 
+# 工具均为 I/O 密集且相互独立，同一轮中的多个工具调用通过线程池并发执行，
+# 单轮耗时取决于最慢的工具，而不是所有工具耗时之和。
+_TOOL_POOL = ThreadPoolExecutor(max_workers=8)
+
+
+# =============================================================================
+# 3.4 文案缓存
+# =============================================================================
+
+# 相同的 (产品, 风格) 每次都要重新走一遍多轮 ReAct 循环，耗时数秒且产生多次 API 调用。
+# 这里用标准库 shelve 做一个持久化的精确匹配缓存：命中时直接返回已生成的 JSON 文案。
+# 缓存键包含模型名与 System Prompt 的哈希，修改提示词或换模型后旧缓存自然失效。
+# 缓存键只使用 hashlib 计算，不依赖内置 hash()，因此不受 PYTHONHASHSEED 影响，跨进程、跨机器保持一致；
+# 可以通过 REDNOTE_CACHE_NAMESPACE 为不同环境或实验划分互不干扰的缓存空间。
+#
+# 缓存分为两张表：(产品, 风格) → 内容哈希，内容哈希 → 文案 JSON。
+# 不同请求（或多次采样）得到相同的文案时只保存一份，缓存大小随不同文案的数量增长，而不是随请求数增长。
+
+CACHE_DIR = os.getenv("REDNOTE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "rednote"))
+CACHE_NAMESPACE = os.getenv("REDNOTE_CACHE_NAMESPACE", "")
+CACHE_TTL = 7 * 86400  # 缓存有效期：7 天
+
+_KEYMAP_PREFIX = "key:"  # 缓存键 → (写入时间, 内容哈希)
+_BLOB_PREFIX = "blob:"  # 内容哈希 → 文案 JSON 字符串
+
+# 内容哈希优先使用 blake3（SIMD 加速），未安装时退回到标准库的 blake2b
+try:
+    from blake3 import blake3 as _content_hasher
+except ImportError:
+    _content_hasher = functools.partial(hashlib.blake2b, digest_size=32)
+
+
+def cache_scope(model: str = DEEPSEEK_MODEL) -> str:
+    """
+    根据命名空间、模型和 System Prompt 计算缓存作用域。
+
+    精确缓存的键和语义缓存的索引文件都包含作用域，换模型、改提示词或切换命名空间后不会命中旧文案。
+    """
+    prompt_hash = hashlib.sha1(SYSTEM_PROMPT.encode("utf-8")).hexdigest()
+    raw_scope = f"{CACHE_NAMESPACE}|{model}|{prompt_hash}"
+    return hashlib.sha1(raw_scope.encode("utf-8")).hexdigest()[:16]
+
+
+def make_cache_key(product_name: str, tone_style: str, model: str = DEEPSEEK_MODEL) -> str:
+    """根据缓存作用域（命名空间、模型、System Prompt）、产品名和风格计算缓存键。"""
+    raw_key = f"{cache_scope(model)}|{product_name}|{tone_style}"
+    return hashlib.sha1(raw_key.encode("utf-8")).hexdigest()
+
+
+def content_hash(note: dict) -> str:
+    """计算文案的内容哈希：对键排序、无空白的规范化 JSON 求哈希，与原始输出的排版无关。"""
+    return _content_hasher(orjson.dumps(note, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+# 异步路径会在线程池中读写缓存；shelve 和语义索引都不支持多线程同时写入，统一用这把锁串行化
+_CACHE_LOCK = threading.Lock()
+
+
+def _open_cache():
+    """打开（必要时创建）磁盘上的文案缓存。"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return shelve.open(os.path.join(CACHE_DIR, "rednote_cache"))
+
+
+def _prune(cache) -> int:
+    """删除已过期的缓存键，以及不再被任何缓存键引用的文案，返回删除的条目数。"""
+    now = time.time()
+    live_digests = set()
+    removed = 0
+    names = list(cache.keys())
+    for name in names:
+        if name.startswith(_KEYMAP_PREFIX):
+            created_at, digest = cache[name]
+            if now - created_at > CACHE_TTL:
+                del cache[name]
+                removed += 1
+            else:
+                live_digests.add(digest)
+    for name in names:
+        if name.startswith(_BLOB_PREFIX) and name[len(_BLOB_PREFIX):] not in live_digests:
+            del cache[name]
+            removed += 1
+    return removed
+
+
+def prune_cache() -> int:
+    """
+    清理磁盘上的文案缓存。
+
+    读到过期条目、或同一缓存键被写入新文案时会自动清理，也可以定期手动调用。
+
+    Returns:
+        int: 删除的缓存键和文案数量。
+    """
+    with _CACHE_LOCK, _open_cache() as cache:
+        return _prune(cache)
+
+
+def cache_get(key: str):
+    """读取缓存中的文案，未命中或已过期时返回 None；读到过期条目时顺带清理缓存。"""
+    with _open_cache() as cache:
+        entry = cache.get(_KEYMAP_PREFIX + key)
+        if entry is None:
+            return None
+        created_at, digest = entry
+        if time.time() - created_at > CACHE_TTL:
+            _prune(cache)
+            return None
+        return cache.get(_BLOB_PREFIX + digest)
+
+
+def cache_get_blob(digest: str):
+    """按内容哈希读取文案，不存在（例如已被清理）时返回 None。"""
+    with _open_cache() as cache:
+        return cache.get(_BLOB_PREFIX + digest)
+
+
+def cache_set(key: str, result: str) -> str:
+    """
+    将成功生成的文案写入缓存，内容相同的文案只保存一份；旧文案不再被引用时将其删除。
+
+    Returns:
+        str: 文案的内容哈希。
+    """
+    digest = content_hash(_loads(result))
+    with _open_cache() as cache:
+        previous = cache.get(_KEYMAP_PREFIX + key)
+        if _BLOB_PREFIX + digest not in cache:
+            cache[_BLOB_PREFIX + digest] = result
+        cache[_KEYMAP_PREFIX + key] = (time.time(), digest)
+        if previous is not None and previous[1] != digest:
+            _prune(cache)
+    return digest
+
+
+# 精确匹配之外，再用语义缓存兜住"近似重复"的请求（见 semantic_cache.py），
+# 语义缓存与精确缓存使用相同的作用域和有效期，精确缓存因过期或提示词变更而失效时不会被语义缓存兜回旧文案；
+# 语义索引中只保存文案的内容哈希，文案本身通过 blob 表读取，同一篇文案不会重复存储；
+# 未安装 sentence-transformers / faiss 时自动跳过。
+_semantic_cache = None
+
+
+def get_semantic_cache():
+    """获取语义缓存实例，依赖缺失时返回 None。"""
+    global _semantic_cache
+    if _semantic_cache is None and semantic_cache_available():
+        _semantic_cache = SemanticCache(CACHE_DIR, scope=cache_scope(), ttl=CACHE_TTL)
+    return _semantic_cache
+
+
+# 不同产品、相同风格的请求还可以走生成式缓存（见 gen_cache.py）：
+# 把已有文案中的产品名替换为新产品名，只在长度变化较大时让 LLM 改写涉及产品名的句子。
+# 模板文件同样按缓存作用域区分。
+# 模板只替换产品名，成分、功效、规格等描述仍然来自原产品，因此生成式缓存默认关闭
+# （use_gen_cache=False），填充得到的文案也不会写入精确缓存或语义缓存。
+_gen_cache = None
+
+
+def get_gen_cache():
+    """获取生成式缓存实例。"""
+    global _gen_cache
+    if _gen_cache is None:
+        _gen_cache = GenerativeCache(CACHE_DIR, scope=cache_scope())
+    return _gen_cache
+
+
+# 按中英文句末标点和换行切分句子
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[。！？!?\n])")
+
+
+def _build_refine_prompt(note: dict, product_name: str, tone_style: str):
+    """找出正文中包含新产品名的句子，并构造改写提示词；没有需要改写的句子时返回 (None, None)。"""
+    sentences = [s for s in _SENTENCE_SPLIT_RE.split(note.get("body", "")) if product_name in s]
+    if not sentences:
+        return None, None
+    prompt = (
+        f"下面这些句子中的产品名刚被替换为「{product_name}」，读起来可能不够通顺。"
+        f"请保持{tone_style}的语气逐句改写，句子数量和顺序不变，"
+        f"以JSON格式输出：{{\"sentences\": [\"改写后的句子\", ...]}}\n"
+        + orjson.dumps(sentences).decode("utf-8")
+    )
+    return sentences, prompt
+
+
+# 改写请求只需要 JSON 模式，不带工具定义
+_REFINE_REQUEST_OPTIONS: Final[dict] = {
+    "model": DEEPSEEK_MODEL,
+    "response_format": {"type": "json_object"},
+}
+
+
+def _refine_failed(note: dict, error) -> dict:
+    """改写失败时打印原因，并原样返回模板填充的文案。"""
+    print(f"[Cache] 改写产品相关句子失败，使用模板填充结果: {error}")
+    return note
+
+
+def _apply_refined_sentences(note: dict, sentences: list, content: str) -> dict:
+    """将 LLM 改写后的句子替换回正文，结果不可用时原样返回。"""
+    try:
+        rewritten = _loads(content)["sentences"]
+    except (JSONDecodeError, KeyError, TypeError) as e:
+        return _refine_failed(note, e)
+    if not isinstance(rewritten, list) or not all(isinstance(s, str) for s in rewritten):
+        return _refine_failed(note, f"sentences 应为字符串列表，实际为 {rewritten!r}")
+    if len(rewritten) != len(sentences):
+        return _refine_failed(note, f"句子数量不一致（{len(rewritten)} / {len(sentences)}）")
+
+    body = note["body"]
+    for old, new in zip(sentences, rewritten):
+        body = body.replace(old, new, 1)
+    return {**note, "body": body}
+
+
+def refine_slot_sentences(client, note: dict, product_name: str, tone_style: str) -> dict:
+    """
+    让 LLM 只改写正文中包含替换后产品名的句子，其余内容保持不变。
+
+    Args:
+        client: DeepSeek 客户端实例
+        note (dict): 由生成式缓存填充得到的文案。
+        product_name (str): 新的产品名称。
+        tone_style (str): 文案风格。
+
+    Returns:
+        dict: 改写后的文案；改写失败时原样返回。
+    """
+    sentences, prompt = _build_refine_prompt(note, product_name, tone_style)
+    if not sentences:
+        return note
+    try:
+        response = client.chat.completions.create(
+            messages=[{"role": "user", "content": prompt}], **_REFINE_REQUEST_OPTIONS)
+    except Exception as e:
+        return _refine_failed(note, e)
+    return _apply_refined_sentences(note, sentences, response.choices[0].message.content)
+
+
+async def arefine_slot_sentences(client, note: dict, product_name: str, tone_style: str) -> dict:
+    """refine_slot_sentences 的异步版本，client 为 AsyncOpenAI 实例。"""
+    sentences, prompt = _build_refine_prompt(note, product_name, tone_style)
+    if not sentences:
+        return note
+    try:
+        response = await client.chat.completions.create(
+            messages=[{"role": "user", "content": prompt}], **_REFINE_REQUEST_OPTIONS)
+    except Exception as e:
+        return _refine_failed(note, e)
+    return _apply_refined_sentences(note, sentences, response.choices[0].message.content)
+
+
+def _lookup_caches(product_name: str, tone_style: str, use_gen_cache: bool = False):
+    """
+    依次查询精确缓存、语义缓存和生成式缓存（仅在 use_gen_cache 为 True 时查询）。
+
+    Returns:
+        tuple: (命中的文案 JSON 字符串, 需要 LLM 改写的文案 dict)，两者至多一个不为 None。
+    """
+    with _CACHE_LOCK:
+        cached = cache_get(make_cache_key(product_name, tone_style))
+        if cached is not None:
+            print(f"[Cache] 命中缓存，产品：{product_name}，风格：{tone_style}")
+            return cached, None
+
+        semantic_cache = get_semantic_cache()
+        if semantic_cache is not None:
+            hit = semantic_cache.lookup(product_name, tone_style)
+            if hit is not None:
+                digest, score = hit
+                cached = cache_get_blob(digest)
+                if cached is not None:
+                    print(f"[Cache] 命中语义缓存（相似度 {score:.3f}），产品：{product_name}，风格：{tone_style}")
+                    return cached, None
+
+        if not use_gen_cache:
+            return None, None
+
+        user_message = USER_PROMPT_TEMPLATE.format(product_name=product_name, tone_style=tone_style)
+        hit = get_gen_cache().lookup(user_message)
+        if hit is not None:
+            note, drift = hit
+            print(f"[Cache] 命中生成式缓存（长度变化 {drift:.0%}），产品：{product_name}，风格：{tone_style}")
+            if drift > LENGTH_DRIFT_LIMIT:
+                return None, note
+            return _dumps(note), None
+
+        return None, None
+
+
+def _store_result(product_name: str, tone_style: str, result: str, use_gen_cache: bool = False) -> None:
+    """将新生成的文案写入各级缓存，无法解析为 JSON 的结果不缓存。"""
+    try:
+        note = _loads(result)
+    except JSONDecodeError:
+        return
+    with _CACHE_LOCK:
+        digest = cache_set(make_cache_key(product_name, tone_style), result)
+        semantic_cache = get_semantic_cache()
+        if semantic_cache is not None:
+            semantic_cache.add(product_name, tone_style, digest)
+        if use_gen_cache:
+            user_message = USER_PROMPT_TEMPLATE.format(product_name=product_name, tone_style=tone_style)
+            get_gen_cache().add(user_message, note)
+
+
+# 文案的输出格式：
+# - pretty：缩进 2 格的 JSON，便于阅读（默认）
+# - compact：无空白的紧凑 JSON，字节数约为 pretty 的一半
+# - jsonl：紧凑 JSON 加换行符，便于逐行追加和流式消费
+# - csv：title,body,hashtags 一行（标签以 ; 分隔），回灌给下游 LLM 时 token 最少
+CSV_FIELDS = ("title", "body", "hashtags")
+
+
+def _to_csv_row(note: dict) -> str:
+    """将文案按 CSV_FIELDS 的顺序序列化为一行 CSV，列表字段以 ; 连接。"""
+    row = []
+    for field in CSV_FIELDS:
+        value = note.get(field, "")
+        row.append(";".join(value) if isinstance(value, list) else value)
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(row)
+    return buffer.getvalue()
+
+
+_SERIALIZERS: Final[dict] = {
+    "pretty": _dumps,
+    "compact": lambda note: orjson.dumps(note).decode("utf-8"),
+    "jsonl": lambda note: orjson.dumps(note).decode("utf-8") + "\n",
+    "csv": _to_csv_row,
+}
+OUTPUT_FORMATS = tuple(_SERIALIZERS)
+
+
+def _check_output_format(output_format: str) -> None:
+    """检查输出格式是否受支持。"""
+    if output_format not in _SERIALIZERS:
+        raise ValueError(f"不支持的输出格式：{output_format}，可选值为 {', '.join(OUTPUT_FORMATS)}")
+
+
+def serialize_rednote(note: dict, output_format: str = "pretty") -> str:
+    """
+    按指定格式序列化文案。
+
+    Args:
+        note (dict): 已解析的文案。
+        output_format (str): 输出格式，取值见 OUTPUT_FORMATS。
+
+    Returns:
+        str: 序列化后的文案。
+    """
+    _check_output_format(output_format)
+    return _SERIALIZERS[output_format](note)
+
+
+def _convert_output(result: str, output_format: str) -> str:
+    """将缓存或 Agent 返回的 JSON 文案转换为目标格式，失败信息原样返回。"""
+    if output_format == "pretty":
+        return result
+    try:
+        note = _loads(result)
+    except JSONDecodeError:
+        return result
+    return serialize_rednote(note, output_format)
+
+
+def cached_rednote(func):
+    """
+    为文案生成函数加上精确匹配缓存、语义缓存和生成式缓存，同时支持同步和异步函数。
+
+    被装饰的函数额外接受三个关键字参数：
+    - use_cache（默认 True）：传入 False 时跳过缓存；
+    - use_gen_cache（默认 False）：是否启用生成式缓存，填充得到的文案只返回、不写入其他缓存；
+    - output_format（默认 "pretty"）：返回结果的格式，取值见 OUTPUT_FORMATS。
+    缓存中始终保存 pretty 格式的 JSON；只有能被解析为 JSON 的结果才会写入缓存，失败信息不会被缓存。
+    """
+    if inspect.iscoroutinefunction(func):
+        async def agenerate(client, product_name, tone_style, use_cache, use_gen_cache, *args, **kwargs):
+            if not use_cache:
+                return await func(client, product_name, tone_style, *args, **kwargs)
+            # 缓存读写涉及磁盘 I/O 和 embedding 计算，放到线程池中执行，避免阻塞其他并发任务
+            loop = asyncio.get_running_loop()
+            cached, note = await loop.run_in_executor(
+                _TOOL_POOL, _lookup_caches, product_name, tone_style, use_gen_cache)
+            if cached is not None:
+                return cached
+            if note is not None:
+                note = await arefine_slot_sentences(client, note, product_name, tone_style)
+                return _dumps(note)
+            result = await func(client, product_name, tone_style, *args, **kwargs)
+            await loop.run_in_executor(_TOOL_POOL, _store_result, product_name, tone_style, result, use_gen_cache)
+            return result
+
+        @functools.wraps(func)
+        async def async_wrapper(client, product_name: str, tone_style: str = "活泼甜美", *args,
+                                use_cache: bool = True, use_gen_cache: bool = False,
+                                output_format: str = "pretty", **kwargs):
+            _check_output_format(output_format)
+            result = await agenerate(client, product_name, tone_style, use_cache, use_gen_cache, *args, **kwargs)
+            return _convert_output(result, output_format)
+
+        return async_wrapper
+
+    def generate(client, product_name, tone_style, use_cache, use_gen_cache, *args, **kwargs):
+        if not use_cache:
+            return func(client, product_name, tone_style, *args, **kwargs)
+        cached, note = _lookup_caches(product_name, tone_style, use_gen_cache)
+        if cached is not None:
+            return cached
+        if note is not None:
+            note = refine_slot_sentences(client, note, product_name, tone_style)
+            return _dumps(note)
+        result = func(client, product_name, tone_style, *args, **kwargs)
+        _store_result(product_name, tone_style, result, use_gen_cache)
+        return result
+
+    @functools.wraps(func)
+    def wrapper(client, product_name: str, tone_style: str = "活泼甜美", *args,
+                use_cache: bool = True, use_gen_cache: bool = False, output_format: str = "pretty", **kwargs):
+        _check_output_format(output_format)
+        result = generate(client, product_name, tone_style, use_cache, use_gen_cache, *args, **kwargs)
+        return _convert_output(result, output_format)
+
+    return wrapper
+
 
 # =============================================================================
 # 4. 实战：构建小红书文案生成 Agent
@@ -224,7 +788,364 @@ available_tools = {
 # 现在，我们将把 System Prompt、工具定义和模拟工具函数整合起来，
 # 构建出能够自动执行的 DeepSeek Agent 工作流。
 # 核心是 generate_rednote 函数，它通过一个循环来模拟 Agent 的 Thought-Action-Observation 过程。
+# agenerate_rednote 是它的异步版本，适合同时为多个产品生成文案。
+
+def _build_messages(product_name: str, tone_style: str) -> deque:
+    """
+    构造初始对话历史，包括系统提示词和用户请求。
+
+    对话历史用 deque 保存，追加为 O(1)；其中每条消息都是普通 dict
+    （assistant 消息由 _StreamAccumulator 直接拼成 dict），请求时无需再把历史消息从 pydantic 模型转换一遍。
+    """
+    return deque([
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": USER_PROMPT_TEMPLATE.format(product_name=product_name, tone_style=tone_style)}
+    ])
+
+
+def _observation_text(tool_result) -> str:
+    """
+    将工具结果转换为 Observation 文本。
+
+    mock_generate_emoji 为了缓存安全返回 tuple，这里先转回 list，
+    保证发给模型的仍是 ['💦', ...] 这种与原先一致的格式。
+    """
+    if isinstance(tool_result, tuple):
+        tool_result = list(tool_result)
+    return str(tool_result)
+
+
+def _run_tool_call(tool_call: dict) -> dict:
+    """执行单个工具调用，返回作为 Observation 的 tool 消息。"""
+    function_name = tool_call["function"]["name"]
+    # 确保参数是合法的JSON字符串，即使工具不要求参数，也需要传递空字典
+    arguments = tool_call["function"]["arguments"]
+    function_args = _loads(arguments) if arguments else {}
+
+    print(f"Agent Action: 调用工具 '{function_name}'，参数：{function_args}")
+
+    # 查找并执行对应的模拟工具函数
+    if function_name in available_tools:
+        tool_function = available_tools[function_name]
+        tool_result = tool_function(**function_args)
+        content = _observation_text(tool_result)  # 工具结果作为字符串返回
+        print(f"Observation: 工具返回结果：{content}")
+    else:
+        content = f"错误：未知的工具 '{function_name}'"
+        print(content)
+
+    return {"role": "tool", "tool_call_id": tool_call["id"], "content": content}
+
+
+# ReAct 循环中每次请求的固定参数。模型、工具定义和 tool_choice 在各轮之间保持不变，
+# 保证请求前缀逐字节一致，从而命中 DeepSeek 的前缀缓存。
+_AGENT_REQUEST_OPTIONS: Final[dict] = {
+    "model": DEEPSEEK_MODEL,
+    "tools": TOOLS_DEFINITION,  # 告知模型可用的工具
+    "tool_choice": "auto",  # 允许模型自动决定是否使用工具
+}
 
+# 预计不再调用工具的请求（最后一轮，或要求模型修正最终文案时）额外启用 JSON 模式，保证输出是合法的 JSON。
+# 其余轮次模型可能输出 Thought 文本，不能启用 JSON 模式。response_format 只影响解码，不改变请求前缀。
+_FINAL_REQUEST_OPTIONS: Final[dict] = {
+    **_AGENT_REQUEST_OPTIONS,
+    "response_format": {"type": "json_object"},
+}
+
+
+def _agent_request_options(messages: deque, last_iteration: bool) -> dict:
+    """
+    选择本轮 ReAct 请求的参数。
+
+    对话历史中只有修正提示会以 user 消息的形式追加在初始请求之后，
+    因此最后一条是 user 消息（且不是初始请求）时，说明模型接下来应直接输出最终文案。
+    """
+    if last_iteration or (len(messages) > 2 and messages[-1]["role"] == "user"):
+        return _FINAL_REQUEST_OPTIONS
+    return _AGENT_REQUEST_OPTIONS
+
+
+class _StreamAccumulator:
+    """
+    拼接流式响应，重建完整的 assistant 消息。
+
+    文本内容以 JSON 对象开头（JSON 模式）或出现 ```json 代码块时，开始跟踪 JSON 对象的括号深度（忽略字符串内的括号），
+    对象闭合时 add() 返回 True，调用方可以立即关闭连接，不再等待模型输出代码块之后的多余说明。
+    工具调用的 name / arguments 会按 index 分片下发，这里负责把它们重新拼接起来。
+    """
+
+    def __init__(self):
+        self._parts = []  # 文本分片，message() 时一次性拼接
+        self._length = 0  # 已处理分片的总长度
+        self._tool_calls = {}
+        self._seen_text = False  # 是否已出现非空白字符
+        self._fence_tail = ""  # 上一分片末尾可能属于 ```json 的部分
+        self._started = False  # 是否已进入 JSON 对象
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._json_end = -1  # JSON 对象闭合后，右括号之后的位置
+        self._fenced = False  # JSON 对象是否包裹在 ```json 代码块中
+        self.finished_early = False
+
+    def add(self, chunk) -> bool:
+        """处理一个流式分片，JSON 对象已完整时返回 True。"""
+        if not chunk.choices:
+            return False
+        delta = chunk.choices[0].delta
+
+        for tool_call in delta.tool_calls or ():
+            entry = self._tool_calls.setdefault(tool_call.index, {
+                "id": None,
+                "type": "function",
+                "function": {"name": "", "arguments": ""},
+            })
+            if tool_call.id:
+                entry["id"] = tool_call.id
+            if tool_call.function is not None:
+                if tool_call.function.name:
+                    entry["function"]["name"] += tool_call.function.name
+                if tool_call.function.arguments:
+                    entry["function"]["arguments"] += tool_call.function.arguments
+
+        if delta.content:
+            self._parts.append(delta.content)
+            self.finished_early = self._scan(delta.content)
+            self._length += len(delta.content)
+        return self.finished_early
+
+    def _find_json_start(self, text: str) -> int:
+        """
+        在新分片中定位 JSON 对象的左括号，尚未出现时返回 -1。
+
+        JSON 模式下内容直接以左括号开头，否则定位 ```json 代码块起点之后的第一个左括号。
+        每个分片只检查一次，不会重复扫描之前的内容。
+        """
+        if not self._seen_text:
+            stripped = text.lstrip()
+            if not stripped:
+                return -1
+            self._seen_text = True
+            if stripped[0] == "{":
+                return len(text) - len(stripped)
+
+        if self._fenced:
+            return text.find("{")
+
+        # 代码块标记可能被拆分在两个分片之间，带上上一分片的末尾一起查找
+        window = self._fence_tail + text
+        fence = window.find("```json")
+        if fence == -1:
+            self._fence_tail = window[-(len("```json") - 1):]
+            return -1
+        self._fenced = True
+        return text.find("{", fence + len("```json") - len(self._fence_tail))
+
+    def _scan(self, text: str) -> bool:
+        """扫描新分片中的括号深度（忽略字符串内的括号），返回 JSON 对象是否已闭合。"""
+        start = 0
+        if not self._started:
+            start = self._find_json_start(text)
+            if start == -1:
+                return False
+            self._started = True
+
+        for index in range(start, len(text)):
+            ch = text[index]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._json_end = self._length + index + 1
+                    return True
+        return False
+
+    def message(self) -> dict:
+        """返回拼接好的 assistant 消息（dict 形式，可直接加入对话历史）。"""
+        content = "".join(self._parts)
+        if self.finished_early:
+            content = content[:self._json_end]
+            if self._fenced:
+                # 提前结束时补上代码块的结尾，保持与完整输出一致的格式
+                content += "\n```"
+        message = {"role": "assistant", "content": content or None}
+        if self._tool_calls:
+            message["tool_calls"] = [self._tool_calls[index] for index in sorted(self._tool_calls)]
+        return message
+
+
+def _stream_chat(client, messages: deque, options: dict = _AGENT_REQUEST_OPTIONS) -> dict:
+    """以流式方式调用 DeepSeek，JSON 文案一旦完整就关闭连接。"""
+    stream = client.chat.completions.create(messages=list(messages), stream=True, **options)
+    accumulator = _StreamAccumulator()
+    for chunk in stream:
+        if accumulator.add(chunk):
+            stream.close()  # 提前结束，不再为多余的 token 付费
+            break
+    return accumulator.message()
+
+
+async def _astream_chat(client, messages: deque, options: dict = _AGENT_REQUEST_OPTIONS) -> dict:
+    """_stream_chat 的异步版本。"""
+    stream = await client.chat.completions.create(messages=list(messages), stream=True, **options)
+    accumulator = _StreamAccumulator()
+    async for chunk in stream:
+        if accumulator.add(chunk):
+            await stream.close()
+            break
+    return accumulator.message()
+
+
+# JSON 模式之外的兜底：最终文案包裹在 ```json 代码块中，模块加载时编译一次
+_JSON_BLOCK_RE = re.compile(r"```json\s*(\{.*\})\s*```", re.DOTALL)
+
+
+def _decode_note(content: str):
+    """
+    按 RednoteFinal 结构解码并校验文案。
+
+    Returns:
+        tuple: (格式化后的 JSON 字符串, None) 或 (None, 错误说明)。
+    """
+    try:
+        note = _NOTE_DECODER.decode(content)
+    except msgspec.ValidationError as e:
+        return None, f"JSON 结构不符合要求：{e}"
+    except msgspec.DecodeError as e:
+        return None, f"JSON 解析失败：{e}"
+    return _dumps(msgspec.to_builtins(note)), None
+
+
+def _parse_final_content(content: str):
+    """
+    解析并校验模型返回的最终 JSON 文案。
+
+    启用 JSON 模式后，内容本身就是一个 JSON 对象，直接解码即可；
+    只有直接解码失败时才退回到提取 ```json 代码块的正则。
+
+    Returns:
+        tuple: 成功时返回 (格式化后的 JSON 字符串, None)；失败时返回 (None, 错误说明)，
+               错误说明会反馈给模型，帮助它在下一轮修正输出。
+    """
+    print(f"[模型生成结果] {content}")
+
+    result, error = _decode_note(content)
+    if result is not None:
+        print("Agent: 任务完成，直接解析最终JSON文案。")
+        return result, None
+
+    # 先用 str.find 快速排除不含代码块的内容，再运行正则
+    json_string_match = _JSON_BLOCK_RE.search(content) if content.find("```json") != -1 else None
+    if not json_string_match:
+        print(f"Agent: 生成的内容不是合法的最终文案，可能还在思考或出错：{error}")
+        return None, error
+
+    extracted_json_content = json_string_match.group(1)
+    result, error = _decode_note(extracted_json_content)
+    if result is not None:
+        print("Agent: 任务完成，成功解析最终JSON文案。")
+        return result, None
+    print(f"Agent: 提取到JSON块但解析失败: {error}")
+    print(f"尝试解析的字符串:\n{extracted_json_content}")
+    return None, error
+
+
+# 旧 Observation 的压缩参数：超过阈值的内容只保留开头部分
+_OBSERVATION_COMPACT_THRESHOLD = 120
+_OBSERVATION_KEEP_CHARS = 80
+
+# 被压缩的 Observation 原文，按 tool_call_id 索引，调试时可直接查看；只保留最近的 256 条
+OBSERVATION_ARCHIVE = {}
+_OBSERVATION_ARCHIVE_LIMIT = 256
+
+
+def _archive_observation(tool_call_id: str, content: str) -> None:
+    """保存被压缩的 Observation 原文，超出上限时丢弃最早的条目。"""
+    OBSERVATION_ARCHIVE[tool_call_id] = content
+    while len(OBSERVATION_ARCHIVE) > _OBSERVATION_ARCHIVE_LIMIT:
+        OBSERVATION_ARCHIVE.pop(next(iter(OBSERVATION_ARCHIVE)))
+
+
+def _compact_observations(messages: deque) -> int:
+    """
+    压缩已经被模型使用过的旧 Observation，减少后续请求需要重新发送的字节数。
+
+    最近一轮工具调用的结果保持完整；更早的 tool 消息如果超过阈值，只保留前 80 个字符，
+    原文按 tool_call_id 保存在 OBSERVATION_ARCHIVE 中便于调试。
+
+    Returns:
+        int: 本次被压缩的消息数。
+    """
+    last_round = -1
+    for index, message in enumerate(messages):
+        if message.get("tool_calls"):
+            last_round = index
+
+    compacted = 0
+    for index, message in enumerate(messages):
+        if index >= last_round:
+            break
+        content = message.get("content") or ""
+        if message["role"] == "tool" and len(content) > _OBSERVATION_COMPACT_THRESHOLD:
+            _archive_observation(message["tool_call_id"], content)
+            message["content"] = content[:_OBSERVATION_KEEP_CHARS] + "…[truncated]"
+            compacted += 1
+    return compacted
+
+
+# 最终文案不合法时追加给模型的修正提示
+_RETRY_PROMPT_TEMPLATE = "上一次输出的文案不符合要求（{error}），请修正后重新输出完整的JSON对象。"
+
+# 生成失败时返回的提示信息（不会被写入缓存）
+_FAILED_RESULT = "未能成功生成文案。"
+
+
+def _handle_final(messages: deque, response_message: dict):
+    """
+    处理不含工具调用的响应，同步和异步的 ReAct 循环共用这部分逻辑。
+
+    需要继续对话时（Thought 或不合法的文案），之前轮次的 Observation 已被模型消化，先压缩再追加本轮响应。
+
+    Args:
+        messages (deque): 对话历史，需要继续对话时会追加本轮响应和修正提示。
+        response_message (dict): 本轮的 assistant 消息。
+
+    Returns:
+        tuple: (result, stop)。解析成功时 result 为文案 JSON 字符串；stop 为 True 时结束循环。
+    """
+    content = response_message["content"]
+    if not content:
+        print("Agent: 未知响应，可能需要更多交互。")
+        return None, True
+
+    if "{" not in content:
+        # 不含 JSON 的纯文本是模型的 Thought，不是格式错误的文案：保留在对话历史中继续下一轮
+        print(f"[模型思考] {content}")
+        _compact_observations(messages)
+        messages.append(response_message)
+        return None, False
+
+    result, error = _parse_final_content(content)
+    if result is not None:
+        return result, True
+    # 解析失败或结构不符，把具体错误反馈给模型，继续对话
+    _compact_observations(messages)
+    messages.append(response_message)
+    messages.append({"role": "user", "content": _RETRY_PROMPT_TEMPLATE.format(error=error)})
+    return None, False
+
+
+@cached_rednote
 def generate_rednote(client, product_name: str, tone_style: str = "活泼甜美", max_iterations: int = 5) -> str:
     """
     使用 DeepSeek Agent 生成小红书爆款文案。
@@ -234,99 +1155,42 @@ def generate_rednote(client, product_name: str, tone_style: str = "活泼甜美"
         product_name (str): 要生成文案的产品名称。
         tone_style (str): 文案的语气和风格，如"活泼甜美"、"知性"、"搞怪"等。
         max_iterations (int): Agent 最大迭代次数，防止无限循环。
+        use_cache (bool): 是否使用文案缓存（由 cached_rednote 提供），默认 True。
+        use_gen_cache (bool): 是否启用生成式缓存（由 cached_rednote 提供），默认 False。
+        output_format (str): 输出格式（由 cached_rednote 提供），"pretty"、"compact"、"jsonl" 或 "csv"，默认 "pretty"。
         
     Returns:
-        str: 生成的爆款文案（JSON 格式字符串）。
+        str: 生成的爆款文案（默认为缩进的 JSON 字符串）。
     """
     
     print(f"\n🚀 启动小红书文案生成助手，产品：{product_name}，风格：{tone_style}\n")
     
     # 存储对话历史，包括系统提示词和用户请求
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": f"请为产品「{product_name}」生成一篇小红书爆款文案。要求：语气{tone_style}，包含标题、正文、至少5个相关标签和5个表情符号。请以完整的JSON格式输出，并确保JSON内容用markdown代码块包裹（例如：```json{{...}}```）。"}
-    ]
+    messages = _build_messages(product_name, tone_style)
     
-    iteration_count = 0
-    final_response = None
-    
-    while iteration_count < max_iterations:
-        iteration_count += 1
+    for iteration_count in range(1, max_iterations + 1):
         print(f"-- Iteration {iteration_count} --")
         
         try:
-            # 调用 DeepSeek API，传入对话历史和工具定义
-            response = client.chat.completions.create(
-                model="deepseek-chat",
-                messages=messages,
-                tools=TOOLS_DEFINITION,  # 告知模型可用的工具
-                tool_choice="auto"  # 允许模型自动决定是否使用工具
-            )
-
-            response_message = response.choices[0].message
+            # 以流式方式调用 DeepSeek API，传入对话历史和工具定义
+            options = _agent_request_options(messages, iteration_count == max_iterations)
+            response_message = _stream_chat(client, messages, options)
             
             # **ReAct模式：处理工具调用**
-            if response_message.tool_calls:  # 如果模型决定调用工具
+            if response_message.get("tool_calls"):  # 如果模型决定调用工具
                 print("Agent: 决定调用工具...")
                 messages.append(response_message)  # 将工具调用信息添加到对话历史
                 
-                tool_outputs = []
-                for tool_call in response_message.tool_calls:
-                    function_name = tool_call.function.name
-                    # 确保参数是合法的JSON字符串，即使工具不要求参数，也需要传递空字典
-                    function_args = json.loads(tool_call.function.arguments) if tool_call.function.arguments else {}
-
-                    print(f"Agent Action: 调用工具 '{function_name}'，参数：{function_args}")
-                    
-                    # 查找并执行对应的模拟工具函数
-                    if function_name in available_tools:
-                        tool_function = available_tools[function_name]
-                        tool_result = tool_function(**function_args)
-                        print(f"Observation: 工具返回结果：{tool_result}")
-                        tool_outputs.append({
-                            "tool_call_id": tool_call.id,
-                            "role": "tool",
-                            "content": str(tool_result)  # 工具结果作为字符串返回
-                        })
-                    else:
-                        error_message = f"错误：未知的工具 '{function_name}'"
-                        print(error_message)
-                        tool_outputs.append({
-                            "tool_call_id": tool_call.id,
-                            "role": "tool",
-                            "content": error_message
-                        })
-                messages.extend(tool_outputs)  # 将工具执行结果作为 Observation 添加到对话历史
+                # 并发执行本轮所有工具调用，结果按 tool_calls 的原始顺序收集
+                futures = [_TOOL_POOL.submit(_run_tool_call, tool_call) for tool_call in response_message["tool_calls"]]
+                messages.extend(future.result() for future in futures)  # 将工具执行结果作为 Observation 添加到对话历史
+                continue
                 
             # **ReAct 模式：处理最终内容**
-            elif response_message.content:  # 如果模型直接返回内容（通常是最终答案）
-                print(f"[模型生成结果] {response_message.content}")
-                
-                # --- START: 添加 JSON 提取和解析逻辑 ---
-                json_string_match = re.search(r"```json\s*(\{.*\})\s*```", response_message.content, re.DOTALL)
-                
-                if json_string_match:
-                    extracted_json_content = json_string_match.group(1)
-                    try:
-                        final_response = json.loads(extracted_json_content)
-                        print("Agent: 任务完成，成功解析最终JSON文案。")
-                        return json.dumps(final_response, ensure_ascii=False, indent=2)
-                    except json.JSONDecodeError as e:
-                        print(f"Agent: 提取到JSON块但解析失败: {e}")
-                        print(f"尝试解析的字符串:\n{extracted_json_content}")
-                        messages.append(response_message)  # 解析失败，继续对话
-                else:
-                    # 如果没有匹配到 ```json 块，尝试直接解析整个 content
-                    try:
-                        final_response = json.loads(response_message.content)
-                        print("Agent: 任务完成，直接解析最终JSON文案。")
-                        return json.dumps(final_response, ensure_ascii=False, indent=2)
-                    except json.JSONDecodeError:
-                        print("Agent: 生成了非JSON格式内容或非Markdown JSON块，可能还在思考或出错。")
-                        messages.append(response_message)  # 非JSON格式，继续对话
-                # --- END: 添加 JSON 提取和解析逻辑 ---
-            else:
-                print("Agent: 未知响应，可能需要更多交互。")
+            result, stop = _handle_final(messages, response_message)
+            if result is not None:
+                return result
+            if stop:
                 break
                 
         except Exception as e:
@@ -334,13 +1198,279 @@ def generate_rednote(client, product_name: str, tone_style: str = "活泼甜美"
             break
     
     print("\n⚠️ Agent 达到最大迭代次数或未能生成最终文案。请检查Prompt或增加迭代次数。")
-    return "未能成功生成文案。"
+    return _FAILED_RESULT
+
+
+@cached_rednote
+async def agenerate_rednote(client, product_name: str, tone_style: str = "活泼甜美", max_iterations: int = 5) -> str:
+    """
+    generate_rednote 的异步版本。
+
+    同一轮中的多个工具调用彼此独立，会被并发执行；多个产品可以通过 asyncio.gather 或
+    arun_batch 同时生成，总耗时取决于最慢的一篇而不是所有文案之和。
+
+    Args:
+        client: AsyncOpenAI 客户端实例（见 setup_async_deepseek_client）
+        product_name (str): 要生成文案的产品名称。
+        tone_style (str): 文案的语气和风格。
+        max_iterations (int): Agent 最大迭代次数，防止无限循环。
+        use_cache (bool): 是否使用文案缓存（由 cached_rednote 提供），默认 True。
+        output_format (str): 输出格式（由 cached_rednote 提供），默认 "pretty"。
+
+    Returns:
+        str: 生成的爆款文案（默认为缩进的 JSON 字符串）。
+    """
+    print(f"\n🚀 启动小红书文案生成助手，产品：{product_name}，风格：{tone_style}\n")
+
+    messages = _build_messages(product_name, tone_style)
+    loop = asyncio.get_running_loop()
+
+    for iteration_count in range(1, max_iterations + 1):
+        print(f"-- [{product_name}] Iteration {iteration_count} --")
+
+        try:
+            options = _agent_request_options(messages, iteration_count == max_iterations)
+            response_message = await _astream_chat(client, messages, options)
+
+            if response_message.get("tool_calls"):
+                print(f"Agent[{product_name}]: 决定调用工具...")
+                messages.append(response_message)
+
+                # 模拟工具是阻塞函数，放到线程池中并发执行
+                messages.extend(await asyncio.gather(*[
+                    loop.run_in_executor(_TOOL_POOL, _run_tool_call, tool_call)
+                    for tool_call in response_message["tool_calls"]
+                ]))
+                continue
+
+            result, stop = _handle_final(messages, response_message)
+            if result is not None:
+                return result
+            if stop:
+                break
+
+        except Exception as e:
+            print(f"调用 DeepSeek API 时发生错误: {e}")
+            break
+
+    print(f"\n⚠️ [{product_name}] Agent 达到最大迭代次数或未能生成最终文案。请检查Prompt或增加迭代次数。")
+    return _FAILED_RESULT
+
+
+# =============================================================================
+# 4.1 固定流程：先本地收集信息，再一次调用 LLM
+# =============================================================================
+
+# 对"产品 → 文案"这个任务，工具调用顺序基本是固定的：查询产品数据库、搜索用户评价、生成表情。
+# generate_rednote_fast 在本地并发执行这三个工具，把结果作为 Observation 直接写进用户消息，
+# 只需调用一次 LLM，而 ReAct 循环通常需要 2~5 次。工具选择确实需要动态决定时再使用 generate_rednote。
+
+_FAST_PIPELINE_STEPS = (
+    ("query_product_database", lambda product_name: product_name),
+    ("search_web", lambda product_name: f"{product_name} 用户评价"),
+    ("generate_emoji", lambda product_name: product_name),
+)
+
+# 固定流程不需要工具定义，只要求模型以 JSON 模式输出最终文案
+_FAST_REQUEST_OPTIONS: Final[dict] = {
+    "model": DEEPSEEK_MODEL,
+    "response_format": {"type": "json_object"},
+}
+
+
+def _build_fast_messages(product_name: str, tone_style: str, observations: list) -> deque:
+    """构造固定流程的对话，把预先收集的 Observation 附在用户请求之后。"""
+    messages = _build_messages(product_name, tone_style)
+    observation_text = "\n".join(
+        f"Observation（{tool_name}）：{_observation_text(result)}"
+        for (tool_name, _), result in zip(_FAST_PIPELINE_STEPS, observations)
+    )
+    messages[-1] = {
+        "role": "user",
+        "content": f"{messages[-1]['content']}\n\n以下是已经收集好的信息，请直接据此输出最终文案：\n{observation_text}",
+    }
+    return messages
+
+
+def _finish_fast_pipeline(response_message: dict) -> str:
+    """解析固定流程的唯一一次 LLM 输出。"""
+    result, _ = _parse_final_content(response_message["content"] or "")
+    if result is None:
+        print("\n⚠️ 固定流程未能生成合法的最终文案，可以尝试使用 ReAct 模式 (--react)。")
+        return _FAILED_RESULT
+    return result
+
+
+@cached_rednote
+def generate_rednote_fast(client, product_name: str, tone_style: str = "活泼甜美") -> str:
+    """
+    使用固定的两步流程生成小红书文案：本地并发执行工具，然后调用一次 DeepSeek。
+
+    Args:
+        client: DeepSeek 客户端实例
+        product_name (str): 要生成文案的产品名称。
+        tone_style (str): 文案的语气和风格。
+        use_cache (bool): 是否使用文案缓存（由 cached_rednote 提供），默认 True。
+        output_format (str): 输出格式（由 cached_rednote 提供），默认 "pretty"。
+
+    Returns:
+        str: 生成的爆款文案（默认为缩进的 JSON 字符串）。
+    """
+    print(f"\n🚀 启动小红书文案生成助手（固定流程），产品：{product_name}，风格：{tone_style}\n")
+
+    futures = [
+        _TOOL_POOL.submit(available_tools[tool_name], make_argument(product_name))
+        for tool_name, make_argument in _FAST_PIPELINE_STEPS
+    ]
+    observations = [future.result() for future in futures]
+    messages = _build_fast_messages(product_name, tone_style, observations)
+
+    try:
+        response_message = _stream_chat(client, messages, _FAST_REQUEST_OPTIONS)
+    except Exception as e:
+        print(f"调用 DeepSeek API 时发生错误: {e}")
+        return _FAILED_RESULT
+    return _finish_fast_pipeline(response_message)
+
+
+@cached_rednote
+async def agenerate_rednote_fast(client, product_name: str, tone_style: str = "活泼甜美") -> str:
+    """generate_rednote_fast 的异步版本，client 为 AsyncOpenAI 实例。"""
+    print(f"\n🚀 启动小红书文案生成助手（固定流程），产品：{product_name}，风格：{tone_style}\n")
+
+    loop = asyncio.get_running_loop()
+    observations = await asyncio.gather(*[
+        loop.run_in_executor(_TOOL_POOL, available_tools[tool_name], make_argument(product_name))
+        for tool_name, make_argument in _FAST_PIPELINE_STEPS
+    ])
+    messages = _build_fast_messages(product_name, tone_style, observations)
+
+    try:
+        response_message = await _astream_chat(client, messages, _FAST_REQUEST_OPTIONS)
+    except Exception as e:
+        print(f"调用 DeepSeek API 时发生错误: {e}")
+        return _FAILED_RESULT
+    return _finish_fast_pipeline(response_message)
+
+
+async def arun_batch(client, requests: list, use_cache: bool = True, output_format: str = "pretty",
+                     react: bool = True) -> list:
+    """
+    并发生成一批文案。
+
+    Args:
+        client: AsyncOpenAI 客户端实例
+        requests (list): (product_name, tone_style) 元组列表。
+        use_cache (bool): 是否使用文案缓存。
+        output_format (str): 输出格式，取值见 OUTPUT_FORMATS。
+        react (bool): True 使用 ReAct 循环，False 使用固定流程 (agenerate_rednote_fast)。
+
+    Returns:
+        list: 与 requests 顺序一致的文案字符串列表。
+    """
+    generate = agenerate_rednote if react else agenerate_rednote_fast
+    return await asyncio.gather(*[
+        generate(client, product_name, tone_style, use_cache=use_cache, output_format=output_format)
+        for product_name, tone_style in requests
+    ])
+
+
+class PrefetchingAgent:
+    """
+    预取式文案生成器。
+
+    已知接下来要处理哪些产品时，schedule() 立即在后台发起生成，不必等前一篇完成；
+    get() 在任务未完成时等待，已完成时直接返回结果。并发数由信号量限制。
+    生成结果经由 cached_rednote 写入各级缓存，后续相似请求可以直接在本地命中。
+
+    get() 取回结果后即释放对应的任务，同一请求再次 get() 会重新调度（通常直接命中缓存）。
+    使用完毕后调用 close()（或使用 async with），取消尚未取回的预取任务并回收其异常。
+    需要在事件循环中创建和使用。
+    """
+
+    def __init__(self, client, max_concurrency: int = 4, react: bool = True, **generate_kwargs):
+        """
+        Args:
+            client: AsyncOpenAI 客户端实例
+            max_concurrency (int): 同时进行的生成任务数上限。
+            react (bool): True 使用 ReAct 循环，False 使用固定流程 (agenerate_rednote_fast)。
+            **generate_kwargs: 传给生成函数的其他参数，如 use_cache、output_format。
+        """
+        self._client = client
+        self._generate_fn = agenerate_rednote if react else agenerate_rednote_fast
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._generate_kwargs = generate_kwargs
+        self._tasks = {}
+
+    def schedule(self, product_name: str, tone_style: str = "活泼甜美") -> asyncio.Task:
+        """在后台发起生成；同一 (产品, 风格) 只会生成一次。"""
+        key = (product_name, tone_style)
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(self._generate(product_name, tone_style))
+            self._tasks[key] = task
+        return task
+
+    async def get(self, product_name: str, tone_style: str = "活泼甜美") -> str:
+        """获取文案，尚未调度的请求会被立即调度；任务完成后从 _tasks 中移除。"""
+        key = (product_name, tone_style)
+        task = self.schedule(product_name, tone_style)
+        try:
+            return await task
+        finally:
+            if task.done() and self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    async def close(self) -> None:
+        """取消所有未取回的任务，并回收它们的结果或异常，避免 "Task exception was never retrieved"。"""
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _generate(self, product_name: str, tone_style: str) -> str:
+        async with self._semaphore:
+            return await self._generate_fn(self._client, product_name, tone_style, **self._generate_kwargs)
 
 
 # =============================================================================
 # 格式化小红书文案
 # =============================================================================
 
+# 标准库解码器只在 orjson 解析失败时使用：orjson 比标准库严格（会拒绝 NaN、孤立的代理字符等），
+# 这类输入交给标准库重新解析以保持原有行为；确实不合法时再给出带行列位置的错误说明。
+_JSON_DECODER = json.JSONDecoder()
+
+# 设置环境变量 REDNOTE_DEBUG=0 时，解析失败的错误信息不再附带原始字符串（例如批量导出大量文案时）
+DEBUG_ERRORS = os.getenv("REDNOTE_DEBUG", "1") == "1"
+
+
+def _decode_with_stdlib(json_string: str):
+    """
+    用标准库解码器重新解析一次。
+
+    Returns:
+        tuple: (解析结果, None) 或 (None, 带位置信息的错误说明)。
+    """
+    # 与 json.loads 相同：跳过首尾的 JSON 空白，之后仍有内容即为多余数据
+    skip_whitespace = json.decoder.WHITESPACE.match
+    try:
+        data, end = _JSON_DECODER.raw_decode(json_string, skip_whitespace(json_string, 0).end())
+    except ValueError as e:
+        return None, str(e)
+    end = skip_whitespace(json_string, end).end()
+    if end != len(json_string):
+        return None, str(json.JSONDecodeError("Extra data", json_string, end))
+    return data, None
+
+
 def format_rednote_for_markdown(json_string: str) -> str:
     """
     将 JSON 格式的小红书文案转换为 Markdown 格式，以便于阅读和发布。
@@ -352,84 +1482,101 @@ def format_rednote_for_markdown(json_string: str) -> str:
     Returns:
         str: 格式化后的 Markdown 文本。
     """
+    # 先走 orjson 的快速路径，只有失败时才用标准库解码器
     try:
-        data = json.loads(json_string)
-    except json.JSONDecodeError as e:
-        return f"错误：无法解析 JSON 字符串 - {e}\n原始字符串：\n{json_string}"
+        data = _loads(json_string)
+    except JSONDecodeError:
+        data, error = _decode_with_stdlib(json_string)
+        if data is None:
+            if not DEBUG_ERRORS:
+                return f"错误：无法解析 JSON 字符串 - {error}"
+            return f"错误：无法解析 JSON 字符串 - {error}\n原始字符串：\n{json_string}"
+
+    return _render_markdown(data)
+
+
+# Markdown 模板：标题使用二级标题，正文保留换行符，最后是空格分隔的标签。
+# 一次 format_map 完成拼接，避免逐段拼接产生的中间字符串。
+_MD_TEMPLATE = "## {title}\n\n{body}\n\n{tags}"
+
 
-    title = data.get("title", "无标题")
-    body = data.get("body", "")
+def _render_markdown(data: dict) -> str:
+    """将已解析的文案 dict 渲染为 Markdown 文本。"""
     hashtags = data.get("hashtags", [])
-    # 表情符号通常已经融入标题和正文中，这里可以选择是否单独列出
-    # emojis = data.get("emojis", []) 
+    # 表情符号通常已经融入标题和正文中，这里不再单独列出
+    return _MD_TEMPLATE.format_map({
+        "title": data.get("title", "无标题"),
+        "body": data.get("body", ""),
+        "tags": " ".join(hashtags) if hashtags else "",  # 小红书标签通常是空格分隔
+    }).rstrip()  # 去除末尾多余的空白
 
-    # 构建 Markdown 文本
-    markdown_output = f"## {title}\n\n"  # 标题使用二级标题
-    
-    # 正文，保留换行符
-    markdown_output += f"{body}\n\n"
-    
-    # Hashtags
-    if hashtags:
-        hashtag_string = " ".join(hashtags)  # 小红书标签通常是空格分隔
-        markdown_output += f"{hashtag_string}\n"
-        
-    # 如果需要，可以单独列出表情符号，但通常它们已经包含在标题和正文中
-    # if emojis:
-    #     emoji_string = " ".join(emojis)
-    #     markdown_output += f"\n使用的表情：{emoji_string}\n"
-        
-    return markdown_output.strip()  # 去除末尾多余的空白
+
+def format_many(notes: list) -> list:
+    """
+    批量将已解析的文案转换为 Markdown，适合从缓存中一次性导出大量文案。
+
+    Args:
+        notes (list): 文案 dict 列表，格式同 format_rednote_for_markdown 的 JSON 输入。
+
+    Returns:
+        list: 与 notes 顺序一致的 Markdown 文本列表。
+    """
+    return [_render_markdown(note) for note in notes]
 
 
 # =============================================================================
 # 5. 实际测试与文案生成
 # =============================================================================
 
-def demo_usage():
-    """演示如何使用小红书文案生成助手"""
+async def _run_demo_cases(client, test_cases: list, use_cache: bool, react: bool) -> None:
+    """
+    依次展示各测试案例的文案，所有案例在开始时就已预取，后面的案例在前面展示时已在生成。
+
+    结束时在同一个事件循环中关闭客户端，释放 HTTP/2 连接池。
+    """
+    async with client, PrefetchingAgent(client, react=react, use_cache=use_cache) as agent:
+        for product_name, tone_style in test_cases:
+            agent.schedule(product_name, tone_style)
+
+        for index, (product_name, tone_style) in enumerate(test_cases, start=1):
+            result = await agent.get(product_name, tone_style)
+
+            print("\n" + "=" * 50)
+            print(f"测试案例 {index}: {product_name}")
+            print("=" * 50)
+
+            print(f"\n--- 生成的文案 {index} (JSON格式) ---")
+            print(result)
+
+            # 格式化显示
+            print(f"\n--- 生成的文案 {index} (Markdown格式) ---")
+            markdown_note = format_rednote_for_markdown(result)
+            print(markdown_note)
+
+
+def demo_usage(use_cache: bool = True, react: bool = False):
+    """
+    演示如何使用小红书文案生成助手
+
+    Args:
+        use_cache (bool): 是否使用文案缓存。
+        react (bool): 是否使用 ReAct 循环；默认使用只调用一次 LLM 的固定流程。
+    """
     
-    # 初始化客户端
+    # 初始化异步客户端，测试案例通过预取并发生成
     try:
-        client = setup_deepseek_client()
+        client = setup_async_deepseek_client()
     except ValueError as e:
         print(f"错误：{e}")
         print("请确保设置了 DEEPSEEK_API_KEY 环境变量")
         return
 
-    # 测试案例 1: 深海蓝藻保湿面膜
-    print("=" * 50)
-    print("测试案例 1: 深海蓝藻保湿面膜")
-    print("=" * 50)
-    
-    product_name_1 = "深海蓝藻保湿面膜"
-    tone_style_1 = "活泼甜美"
-    result_1 = generate_rednote(client, product_name_1, tone_style_1)
-
-    print("\n--- 生成的文案 1 (JSON格式) ---")
-    print(result_1)
-    
-    # 格式化显示
-    print("\n--- 生成的文案 1 (Markdown格式) ---")
-    markdown_note_1 = format_rednote_for_markdown(result_1)
-    print(markdown_note_1)
-
-    # 测试案例 2: 美白精华
-    print("\n" + "=" * 50)
-    print("测试案例 2: 美白精华")
-    print("=" * 50)
-    
-    product_name_2 = "美白精华"
-    tone_style_2 = "知性温柔"
-    result_2 = generate_rednote(client, product_name_2, tone_style_2)
-
-    print("\n--- 生成的文案 2 (JSON格式) ---")
-    print(result_2)
-    
-    # 格式化显示
-    print("\n--- 生成的文案 2 (Markdown格式) ---")
-    markdown_note_2 = format_rednote_for_markdown(result_2)
-    print(markdown_note_2)
+    # 测试案例 1: 深海蓝藻保湿面膜；测试案例 2: 美白精华
+    test_cases = [
+        ("深海蓝藻保湿面膜", "活泼甜美"),
+        ("美白精华", "知性温柔"),
+    ]
+    asyncio.run(_run_demo_cases(client, test_cases, use_cache, react))
 
 
 def demo_format_function():
@@ -469,6 +1616,11 @@ def demo_format_function():
 
 def main():
     """主程序入口"""
+    parser = argparse.ArgumentParser(description="DeepSeek Agent 小红书爆款文案生成助手")
+    parser.add_argument("--no-cache", action="store_true", help="跳过文案缓存，强制重新调用 DeepSeek 生成")
+    parser.add_argument("--react", action="store_true", help="使用 ReAct 循环（由模型动态选择工具），默认使用固定流程")
+    args = parser.parse_args()
+
     print("DeepSeek Agent 实战：小红书爆款文案生成助手")
     print("=" * 60)
     
@@ -484,7 +1636,7 @@ def main():
     # 如果设置了环境变量，可以运行实际测试
     if os.getenv("DEEPSEEK_API_KEY"):
         print("\n检测到 DEEPSEEK_API_KEY，开始运行实际测试...")
-        demo_usage()
+        demo_usage(use_cache=not args.no_cache, react=args.react)
     else:
         print("\n未检测到 DEEPSEEK_API_KEY 环境变量，跳过实际测试。")
 
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+小红书文案语义缓存
+
+精确匹配缓存无法命中"深海蓝藻保湿面膜"/"蓝藻深海保湿面膜"、"活泼甜美"/"甜美活泼"这类
+只有细微差别的请求，而每次未命中都意味着一次完整的多轮 DeepSeek 调用。
+语义缓存将 (产品, 风格) 编码为向量，在已生成的文案中查找余弦相似度不低于阈值的最近邻，
+命中时直接复用已有文案。
+
+依赖 sentence-transformers、faiss 和 numpy（均为可选依赖），未安装时语义缓存自动禁用。
+"""
+
+import os
+import time
+import pickle
+
+DEFAULT_MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"
+DEFAULT_THRESHOLD = float(os.getenv("REDNOTE_SEMANTIC_THRESHOLD", "0.93"))
+
+# 查询时取最相近的若干条，跳过其中已过期的条目
+_SEARCH_K = 8
+
+
+def semantic_cache_available() -> bool:
+    """检查语义缓存所需的可选依赖是否已安装。"""
+    try:
+        import faiss  # noqa: F401
+        import numpy  # noqa: F401
+        import sentence_transformers  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class SemanticCache:
+    """
+    基于向量相似度的文案缓存。
+
+    向量经过 L2 归一化后存入 faiss.IndexFlatIP，内积即余弦相似度。
+    向量与文案分别通过 np.save 和 pickle 持久化到 cache_dir 下：两个文件都先写入临时文件再 os.replace，
+    加载时行数不一致（例如写入中途进程崩溃）则丢弃已持久化的状态，从空索引重新开始。
+
+    scope 标识生成文案时的命名空间、模型和 System Prompt，每个 scope 使用独立的索引文件，
+    换模型或修改提示词后不会命中旧文案。每条文案都记录写入时间，超过 ttl 秒的条目不再命中，
+    并在下一次 add() 时从索引中删除。
+    """
+
+    def __init__(self, cache_dir: str, scope: str = "", ttl: float = None,
+                 threshold: float = DEFAULT_THRESHOLD, model_name: str = DEFAULT_MODEL_NAME):
+        import faiss
+        import numpy as np
+
+        self.threshold = threshold
+        self.model_name = model_name
+        self.ttl = ttl
+        suffix = f"_{scope}" if scope else ""
+        self._vectors_path = os.path.join(cache_dir, f"semantic_vectors{suffix}.npy")
+        self._responses_path = os.path.join(cache_dir, f"semantic_responses{suffix}.pkl")
+        self._model = None  # 首次使用时再加载 embedding 模型
+        self._index = None
+        self._responses = []  # 与索引行一一对应的 (写入时间, 文案或其内容哈希)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        if os.path.exists(self._vectors_path) and os.path.exists(self._responses_path):
+            vectors = np.load(self._vectors_path)
+            with open(self._responses_path, "rb") as f:
+                responses = pickle.load(f)
+            if len(responses) == vectors.shape[0]:
+                self._responses = responses
+                self._index = faiss.IndexFlatIP(vectors.shape[1])
+                self._index.add(vectors)
+            else:
+                print(f"[Cache] 语义缓存向量与文案数量不一致（{vectors.shape[0]} / {len(responses)}），已丢弃")
+
+    @staticmethod
+    def make_key_text(product_name: str, tone_style: str) -> str:
+        """构造用于编码的请求文本。"""
+        return f"{product_name}||{tone_style}"
+
+    def _embed(self, text: str):
+        """将文本编码为 L2 归一化的 float32 向量，形状为 (1, dim)。"""
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return self._model.encode([text], normalize_embeddings=True).astype("float32")
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        """判断写入时间为 created_at 的条目是否已过期。"""
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def lookup(self, product_name: str, tone_style: str):
+        """
+        查找语义相近且未过期的已缓存文案。
+
+        Returns:
+            tuple | None: 命中时返回 (add() 时存入的 result, 相似度)，否则返回 None。
+        """
+        if self._index is None or self._index.ntotal == 0:
+            return None
+        vector = self._embed(self.make_key_text(product_name, tone_style))
+        scores, ids = self._index.search(vector, min(_SEARCH_K, self._index.ntotal))
+        now = time.time()
+        for score, idx in zip(scores[0].tolist(), ids[0].tolist()):
+            if idx < 0 or idx >= len(self._responses) or score < self.threshold:
+                break  # 结果按相似度降序排列，后面的条目只会更不相似
+            created_at, result = self._responses[idx]
+            if not self._expired(created_at, now):
+                return result, score
+        return None
+
+    def add(self, product_name: str, tone_style: str, result: str) -> None:
+        """
+        将新生成的文案加入索引并持久化，同时删除已过期的条目。
+
+        result 可以是文案本身，也可以是文案的内容哈希（rednote.py 存入哈希，文案由精确缓存的 blob 表去重保存）。
+        """
+        import faiss
+        import numpy as np
+
+        vector = self._embed(self.make_key_text(product_name, tone_style))
+        now = time.time()
+        vectors = vector
+        if self._index is not None and self._index.ntotal:
+            keep = [i for i, (created_at, _) in enumerate(self._responses) if not self._expired(created_at, now)]
+            old_vectors = self._index.reconstruct_n(0, self._index.ntotal)[keep]
+            vectors = np.concatenate([old_vectors, vector])
+            self._responses = [self._responses[i] for i in keep]
+        self._index = faiss.IndexFlatIP(vector.shape[1])
+        self._index.add(vectors)
+        self._responses.append((now, result))
+
+        vectors_tmp = self._vectors_path + ".tmp"
+        responses_tmp = self._responses_path + ".tmp"
+        # 传入文件对象，避免 np.save 自动给临时文件名追加 .npy 后缀
+        with open(vectors_tmp, "wb") as f:
+            np.save(f, vectors)
+        with open(responses_tmp, "wb") as f:
+            pickle.dump(self._responses, f)
+        os.replace(vectors_tmp, self._vectors_path)
+        os.replace(responses_tmp, self._responses_path)